@@ -1,22 +1,112 @@
-from flask import Flask
+from flask import Flask, g, has_app_context
 import twitter
+from twitter import metrics
 import sys
 import sqlite3
 import argparse
+import threading
+import logging
+import logging.handlers
+import random
+import queue
+import json
+import time
+import os
+
+log_path = "log.txt"
+log_max_bytes = 10 * 1024 * 1024
+log_backups = 5
+log_queue_size = 10000
+log_payload_limit = 4096
+log_payload_sample = 0.1
+server_threads = 8
+connection_pool_size = 32
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "message": record.getMessage()
+        }
+        if hasattr(record, "payload"):
+            payload = json.dumps(record.payload, default=str)
+            if len(payload) <= log_payload_limit:
+                entry["payload"] = payload
+            elif record.levelno >= logging.ERROR or random.random() < log_payload_sample: #only large warning/info dumps are sampled
+                entry["payload"] = payload[:log_payload_limit] + "...(truncated)"
+            else:
+                entry["payload_omitted"] = len(payload)
+        return json.dumps(entry)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        #formatting (and serializing payloads) is left to the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.log_dropped.inc()
 
 class StatefulFlask(Flask):
     def __init__(self, name):
         super().__init__(name)
         self.state = {}
-        self.log_file = open("log.txt", "a", buffering=1)
+        self.connections = {}
+        self.connections_lock = threading.Lock()
+        self.teardown_appcontext(self.release_connections)
+        self.log_logger = logging.getLogger("hydrus-api")
+        self.log_logger.propagate = False
+        self.log_logger.setLevel(logging.DEBUG)
+        self.start_logging()
+
+    def start_logging(self, path=log_path):
+        #also called in each worker after a fork, since the listener thread does not survive it
+        file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=log_max_bytes, backupCount=log_backups, encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter())
+        log_queue = queue.Queue(maxsize=log_queue_size)
+        self.log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+        self.log_listener.start()
+        for handler in self.log_logger.handlers[:]:
+            self.log_logger.removeHandler(handler)
+        self.log_logger.addHandler(NonBlockingQueueHandler(log_queue))
 
-    def connect(self):
-        con = sqlite3.connect("master.db", detect_types=sqlite3.PARSE_DECLTYPES)
+    def connect(self, database="master.db"):
+        #connections are checked out for the life of an app context and handed back on teardown,
+        #so they (and their statement caches) are reused even though the dev server starts a thread per request
+        if not has_app_context(): return self.open_connection(database)
+        checked_out = g.setdefault("connections", {})
+        if database not in checked_out:
+            with self.connections_lock:
+                pool = self.connections.setdefault(database, queue.LifoQueue(maxsize=connection_pool_size))
+            try:
+                checked_out[database] = pool.get_nowait()
+            except queue.Empty:
+                checked_out[database] = self.open_connection(database)
+        return checked_out[database]
+
+    def open_connection(self, database):
+        con = sqlite3.connect(database, detect_types=sqlite3.PARSE_DECLTYPES, cached_statements=256, check_same_thread=False)
         con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode = WAL").close()
+        con.execute("PRAGMA synchronous = NORMAL").close()
+        con.execute("PRAGMA cache_size = -16000").close()
+        con.execute("PRAGMA busy_timeout = 5000").close()
         return con
 
-    def log(self, *objects, sep=' ', end='\n'):
-        self.log_file.write(sep.join([str(o) for o in objects]) + end)
+    def release_connections(self, exception=None):
+        for database, con in g.pop("connections", {}).items():
+            if con.in_transaction: con.rollback()
+            try:
+                self.connections[database].put_nowait(con)
+            except queue.Full:
+                con.close()
+
+    def log(self, *objects, sep=' ', level="info", payload=None):
+        extra = {"payload": payload} if payload is not None else None
+        self.log_logger.log(logging.getLevelName(level.upper()), sep.join([str(o) for o in objects]), extra=extra)
 
     def run(self, host=None, port=None, debug=None, load_dotenv=True, **options):
         if not self.debug or os.getenv("WERKZEUG_RUN_MAIN") == "true":
@@ -26,6 +116,38 @@ class StatefulFlask(Flask):
 
 app = StatefulFlask(__name__)
 
+def serve(workers, host, port):
+    #pre-forking production server; each worker runs setup after the fork and shares rate limits and caches through sqlite
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        sys.exit("run --workers needs gunicorn, install it with `pip install gunicorn`")
+
+    def pre_fork(server, worker):
+        #number workers 0..n-1 so a restarted worker takes over its predecessor's log file
+        taken = {getattr(other, "slot", None) for other in server.WORKERS.values()}
+        worker.slot = next(slot for slot in range(len(taken) + 1) if slot not in taken)
+
+    def post_fork(server, worker):
+        app.start_logging(f"{os.path.splitext(log_path)[0]}.{worker.slot}.txt")
+        metrics.set_worker(worker.slot)
+        with app.app_context():
+            twitter.setup(shared=workers > 1)
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("threads", server_threads)
+            self.cfg.set("pre_fork", pre_fork)
+            self.cfg.set("post_fork", post_fork)
+
+        def load(self):
+            return app
+
+    Server().run()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         prog="Api Helper",
@@ -34,13 +156,18 @@ if __name__ == "__main__":
     subparsers = parser.add_subparsers(required=True, dest="command")
     
     parser_run = subparsers.add_parser("run", help="runs the server")
+    parser_run.add_argument("--workers", type=int, help="serve with this many gunicorn worker processes instead of the development server")
+    parser_run.add_argument("--host", default="127.0.0.1", help="the address to listen on")
+    parser_run.add_argument("--port", type=int, default=5000, help="the port to listen on")
     parser_add = subparsers.add_parser("add", help="adds an account for the api to use")
     parser_list = subparsers.add_parser("list", help="lists accounts for a given service")
     parser_delete = subparsers.add_parser("del", help="removes an account from a given service")
+    parser_export = subparsers.add_parser("export", help="writes a user's whole media timeline to stdout as ndjson")
+    parser_warm = subparsers.add_parser("warm", help="resolves a list of users ahead of time so their first requests are fast")
     
     subparsers_add = parser_add.add_subparsers(required=True, dest="service")
     twitter_add = subparsers_add.add_parser("twitter", help="add a twitter account")
-    twitter_add.add_argument("priority", help="an integer describing the priority of the account - the lowest is always used first")
+    twitter_add.add_argument("priority", help="an integer describing the priority of the account - lower goes first when accounts are otherwise equal (with the default lru schedule, the least recently used account goes first)")
     twitter_add.add_argument("auth_token", help="the auth_token cookie of the account")
     twitter_add.add_argument("csrf_token", help="the x-csrf-token header of the account")
     twitter_add.add_argument("bearer_token", help="the authorization header of the account")
@@ -50,14 +177,27 @@ if __name__ == "__main__":
     subparsers_del = parser_delete.add_subparsers(required=True, dest="service")
     twitter_del = subparsers_del.add_parser("twitter", help="remove a twitter account")
     twitter_del.add_argument("id", help="the id of the account to remove")
+
+    subparsers_export = parser_export.add_subparsers(required=True, dest="service")
+    twitter_export = subparsers_export.add_parser("twitter", help="export a twitter user's media tweets")
+    twitter_export.add_argument("username", help="the screen name of the user to export")
+    twitter_export.add_argument("--since-id", help="stop at the first tweet with this id or older")
+    twitter_export.add_argument("--cursor", help="resume from this timeline cursor")
+
+    subparsers_warm = parser_warm.add_subparsers(required=True, dest="service")
+    twitter_warm = subparsers_warm.add_parser("twitter", help="resolve the rest ids of twitter users")
+    twitter_warm.add_argument("file", help="a file with one screen name per line")
     
     args = parser.parse_args(sys.argv[1:])
     match args.command:
         case "run":
             try:
-                app.run(debug=True)
+                if args.workers:
+                    serve(args.workers, args.host, args.port)
+                else:
+                    app.run(host=args.host, port=args.port, debug=True)
             finally:
-                app.log_file.close()
+                app.log_listener.stop()
         case "add":
             match args.service:
                 case "twitter":
@@ -77,4 +217,30 @@ if __name__ == "__main__":
                 case "twitter":
                     with app.connect() as con:
                         con.execute("DELETE FROM twitter_credentials WHERE user_id = ?", (args.id))
-                        print("Delete successful.")
\ No newline at end of file
+                        print("Delete successful.")
+        case "export":
+            match args.service:
+                case "twitter":
+                    try:
+                        with app.app_context():
+                            twitter.setup()
+                            if "twitter" in app.state:
+                                for line in twitter.export(args.username, args.since_id, args.cursor):
+                                    sys.stdout.buffer.write(line)
+                    finally:
+                        app.log_listener.stop()
+        case "warm":
+            match args.service:
+                case "twitter":
+                    try:
+                        with open(args.file, encoding="utf-8") as f:
+                            usernames = [line.strip().lstrip("@") for line in f if line.strip()]
+                        with app.app_context():
+                            twitter.setup()
+                            if "twitter" in app.state:
+                                result = twitter.warm(usernames)
+                                print(f"{result['known']} already known, {result['resolved']} resolved, {len(result['failed'])} failed.")
+                                for username, note in result["failed"].items():
+                                    print(f"{username}: {note}")
+                    finally:
+                        app.log_listener.stop()
\ No newline at end of file
@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+from . import mock_graphql
+from .run import _seed
+import tempfile
+import time
+import requests
+import sys
+import os
+
+#regression checks for upstream call budgets, run against the mock api: python -m benchmarks.checks
+def _start(mock, accounts=3):
+    mock_server = mock_graphql.serve(mock)
+    os.chdir(tempfile.mkdtemp(prefix="hydrus-check-"))
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    _seed(accounts)
+    import api
+    import twitter
+    from twitter import endpoints
+    endpoints.graphql_url = f"http://127.0.0.1:{mock_server.server_port}/graphql"
+    with api.app.app_context():
+        twitter.setup()
+    api_server = mock_graphql.serve(api.app)
+    return f"http://127.0.0.1:{api_server.server_port}"
+
+def _walk(session, base, url):
+    pages = 0
+    while url:
+        page = session.get(f"{base}/twitter/{url}").json()
+        pages += 1
+        url = page.get("next_page")
+    return pages
+
+def check_incremental(base, mock):
+    session = requests.Session()
+    first = _walk(session, base, "media?username=user0&incremental")
+    before = mock.calls.get("UserMedia", 0)
+    second = _walk(session, base, "media?username=user0&incremental")
+    calls = mock.calls.get("UserMedia", 0) - before
+    assert first > 1, f"first sync should span several pages, got {first}"
+    assert second == 1 and calls == 1, f"a repeat sync should cost one UserMedia call, took {second} pages and {calls} calls"
+
+def check_coalescing(base, mock):
+    before = dict(mock.calls)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: requests.get(f"{base}/twitter/media?username=user1"), range(4)))
+        list(executor.map(lambda _: requests.get(f"{base}/twitter/tweet?tweet=100100001"), range(4)))
+    calls = {operation: count - before.get(operation, 0) for operation, count in mock.calls.items()}
+    for operation in ("UserByScreenName", "UserMedia", "TweetResultByRestId"):
+        assert calls.get(operation) == 1, f"4 identical concurrent requests should make one {operation} call, made {calls.get(operation)}"
+
+def check_hidden_creator(base, mock):
+    #user4 is protected and followed by no account: one background recheck, not one per request;
+    #runs first, since the refresher also rechecks every other creator requested so far
+    before = mock.calls.get("UserByRestId", 0)
+    for _ in range(5):
+        requests.get(f"{base}/twitter/media?username=user4")
+        time.sleep(0.3)
+    calls = mock.calls.get("UserByRestId", 0) - before
+    assert calls <= 3, f"repeat requests for a hidden creator should not each recheck every account, made {calls} UserByRestId calls"
+
+checks = [check_hidden_creator, check_incremental, check_coalescing]
+
+def main():
+    mock = mock_graphql.MockGraphQL(__name__, users=5, tweets_per_user=60, latency=0.05, jitter=0, protected=["user4"])
+    base = _start(mock)
+    failed = 0
+    for check in checks:
+        try:
+            check(base, mock)
+            print(f"ok   {check.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL {check.__name__}: {e}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,167 @@
+from flask import Flask, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+import threading
+import argparse
+import random
+import json
+import time
+import os
+
+#stands in for api.twitter.com/graphql: synthetic (or recorded) payloads, latency, 429s and block/protect flags
+class MockGraphQL(Flask):
+    def __init__(self, name, users=20, tweets_per_user=200, page_size=20, latency=0.05, jitter=0.5,
+                 rate_limit=500, rate_window=900, error_rate=0.0, blocked=(), protected=(), recorded=None):
+        super().__init__(name)
+        self.users = {f"user{n}": 1000 + n for n in range(users)}
+        self.tweets_per_user = tweets_per_user
+        self.page_size = page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.error_rate = error_rate
+        self.blocked = {self.users[name] for name in blocked}
+        self.protected = {self.users[name] for name in protected}
+        self.recorded = {}
+        if recorded:
+            for file in os.listdir(recorded):
+                if file.endswith(".json"):
+                    with open(os.path.join(recorded, file), "rb") as f:
+                        self.recorded[file.removesuffix(".json")] = f.read()
+        self.lock = threading.Lock()
+        self.limits = {}
+        self.calls = {}
+        self.add_url_rule("/graphql/<query_id>/<operation>", view_func=self.graphql)
+        self.add_url_rule("/calls", view_func=lambda: self.calls)
+
+    def _tweet(self, rest_id, tweet_id):
+        return {
+            "__typename": "Tweet",
+            "rest_id": str(tweet_id),
+            "core": {"user_results": {"result": self._user(rest_id)}},
+            "views": {"count": str(random.randint(0, 100000)), "state": "EnabledWithCount"},
+            "legacy": {
+                "id_str": str(tweet_id),
+                "user_id_str": str(rest_id),
+                "created_at": "Mon Jan 01 00:00:00 +0000 2024",
+                "full_text": f"tweet {tweet_id} " + "lorem ipsum " * 20,
+                "favorite_count": random.randint(0, 1000),
+                "retweet_count": random.randint(0, 100),
+                "entities": {"hashtags": [], "urls": [], "user_mentions": []},
+                "extended_entities": {"media": [{
+                    "id_str": str(tweet_id * 10 + n),
+                    "type": "photo",
+                    "media_url_https": f"https://pbs.twimg.com/media/{tweet_id}_{n}.jpg",
+                    "original_info": {"width": 1200, "height": 1600}
+                } for n in range(random.randint(1, 4))]}
+            }
+        }
+
+    def _user(self, rest_id):
+        legacy = {
+            "screen_name": next(name for name, user in self.users.items() if user == rest_id),
+            "description": "bio " * 40,
+            "followers_count": 1000,
+            "profile_image_url_https": "https://pbs.twimg.com/profile_images/0/normal.jpg"
+        }
+        if rest_id in self.blocked: legacy["blocked_by"] = True
+        if rest_id in self.protected: legacy["protected"] = True
+        return {"__typename": "User", "rest_id": str(rest_id), "legacy": legacy}
+
+    def _user_media(self, rest_id, cursor):
+        if rest_id in self.blocked or rest_id in self.protected:
+            return {"data": {"user": {}}}
+        offset = int(cursor or 0)
+        newest = rest_id * 100000 + self.tweets_per_user
+        items = [
+            {"item": {"itemContent": {"tweet_results": {"result": self._tweet(rest_id, newest - n)}}}}
+            for n in range(offset, min(offset + self.page_size, self.tweets_per_user))
+        ]
+        entries = [
+            {"content": {"__typename": "TimelineTimelineModule", "items": items}} if items else None,
+            {"content": {"__typename": "TimelineTimelineCursor", "cursorType": "Top", "value": "0"}},
+            {"content": {"__typename": "TimelineTimelineCursor", "cursorType": "Bottom", "value": str(offset + self.page_size)}}
+        ]
+        return {"data": {"user": {"result": {"__typename": "User", "timeline_v2": {"timeline": {"instructions": [
+            {"type": "TimelineClearCache"},
+            {"type": "TimelineAddEntries", "entries": [entry for entry in entries if entry]}
+        ]}}}}}}
+
+    def _payload(self, operation, variables):
+        match operation:
+            case "UserByScreenName":
+                rest_id = self.users.get(variables["screen_name"])
+                return {"data": {"user": {"result": self._user(rest_id)}}} if rest_id else {"data": {}}
+            case "UserByRestId":
+                return {"data": {"user": {"result": self._user(int(variables["userId"]))}}}
+            case "UserMedia":
+                return self._user_media(int(variables["userId"]), variables.get("cursor"))
+            case "TweetResultByRestId":
+                tweet_id = int(variables["tweetId"])
+                return {"data": {"tweetResult": {"result": self._tweet(tweet_id // 100000, tweet_id)}}}
+
+    def graphql(self, query_id, operation):
+        account = request.cookies.get("auth_token")
+        now = time.time()
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            remaining, reset = self.limits.get((account, operation), (self.rate_limit, now + self.rate_window))
+            if reset <= now: remaining, reset = self.rate_limit, now + self.rate_window
+            remaining = max(remaining - 1, -1)
+            self.limits[(account, operation)] = (remaining, reset)
+        time.sleep(max(0, random.gauss(self.latency, self.latency * self.jitter)))
+        headers = {
+            "content-type": "application/json",
+            "x-rate-limit-limit": str(self.rate_limit),
+            "x-rate-limit-remaining": str(max(remaining, 0)),
+            "x-rate-limit-reset": str(int(reset))
+        }
+        if remaining < 0 or random.random() < self.error_rate:
+            return '{"errors": [{"message": "Rate limit exceeded", "code": 88}]}', 429, headers
+        if operation in self.recorded:
+            return self.recorded[operation], 200, headers
+        return json.dumps(self._payload(operation, json.loads(request.args["variables"]))), 200, headers
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+def serve(app, port=0):
+    server = make_server("127.0.0.1", port, app, threaded=True, request_handler=_QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def parser():
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--users", type=int, default=20, help="number of mock creators, named user0..userN")
+    parser.add_argument("--tweets-per-user", type=int, default=200, help="media tweets in each creator's timeline")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean upstream latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency standard deviation as a fraction of the mean")
+    parser.add_argument("--rate-limit", type=int, default=500, help="calls per account and operation per window")
+    parser.add_argument("--rate-window", type=int, default=900, help="rate limit window in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with an injected 429")
+    parser.add_argument("--blocked", default="", help="comma separated creators that have blocked every account")
+    parser.add_argument("--protected", default="", help="comma separated protected creators no account follows")
+    parser.add_argument("--recorded", help="directory of recorded <Operation>.json payloads to replay instead")
+    return parser
+
+def from_args(args):
+    return MockGraphQL(
+        __name__,
+        users=args.users,
+        tweets_per_user=args.tweets_per_user,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        rate_window=args.rate_window,
+        error_rate=args.error_rate,
+        blocked=[name for name in args.blocked.split(",") if name],
+        protected=[name for name in args.protected.split(",") if name],
+        recorded=args.recorded
+    )
+
+if __name__ == "__main__":
+    main_parser = argparse.ArgumentParser(parents=[parser()], description="serves a mock twitter graphql api for benchmarking")
+    main_parser.add_argument("--port", type=int, default=5001)
+    args = main_parser.parse_args()
+    from_args(args).run(host="127.0.0.1", port=args.port, threaded=True)
\ No newline at end of file
@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+from . import mock_graphql
+import statistics
+import argparse
+import tempfile
+import requests
+import sqlite3
+import time
+import sys
+import os
+
+#drives /twitter/media and /twitter/tweet against the mock api and reports latency, throughput and upstream cost
+def _seed(accounts):
+    con = sqlite3.connect("master.db")
+    import twitter.queries
+    con.executescript(twitter.queries.create_tables)
+    for n in range(accounts):
+        con.execute("INSERT INTO twitter_credentials VALUES(NULL, ?, ?, ?, ?)", (n, f"{n:040d}", f"{n:0160d}", "Bearer " + f"{n:0104d}"))
+    con.commit()
+    con.close()
+
+def _sync(base, username, pages, latencies):
+    session = requests.Session()
+    url = f"{base}/twitter/media?username={username}"
+    for _ in range(pages):
+        start = time.perf_counter()
+        response = session.get(url)
+        latencies["media"].append(time.perf_counter() - start)
+        page = response.json()
+        for tweet_id in page.get("tweet_ids", []):
+            start = time.perf_counter()
+            session.get(f"{base}/twitter/tweet?tweet={tweet_id}")
+            latencies["tweet"].append(time.perf_counter() - start)
+        if not page.get("tweet_ids") or "next_page" not in page: break
+        url = f"{base}/twitter/{page['next_page']}"
+
+def _percentiles(values):
+    if len(values) < 2: return values * 3 if values else [0, 0, 0]
+    cuts = statistics.quantiles(values, n=100)
+    return [cuts[49], cuts[94], cuts[98]]
+
+def main():
+    parser = argparse.ArgumentParser(parents=[mock_graphql.parser()], description="benchmarks the twitter endpoints against a local mock graphql api")
+    parser.add_argument("--accounts", type=int, default=3, help="number of fake accounts to seed")
+    parser.add_argument("--pages", type=int, default=3, help="media pages to walk per creator")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of concurrent hydrus-like clients")
+    parser.add_argument("--rounds", type=int, default=1, help="times to sync every creator, to measure warm caches")
+    parser.add_argument("--query", default="", help="extra query string for /twitter/media, e.g. prefetch=2")
+    args = parser.parse_args()
+
+    mock = mock_graphql.from_args(args)
+    mock_server = mock_graphql.serve(mock)
+
+    os.chdir(tempfile.mkdtemp(prefix="hydrus-bench-"))
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    _seed(args.accounts)
+    import api
+    import twitter
+    from twitter import endpoints
+    endpoints.graphql_url = f"http://127.0.0.1:{mock_server.server_port}/graphql"
+    with api.app.app_context():
+        twitter.setup()
+    api_server = mock_graphql.serve(api.app)
+    base = f"http://127.0.0.1:{api_server.server_port}"
+
+    usernames = [f"user{n}" for n in range(args.users)] * args.rounds
+    suffix = "&" + args.query if args.query else ""
+    latencies = {"media": [], "tweet": []}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for _ in executor.map(lambda username: _sync(base, username + suffix, args.pages, latencies), usernames): pass
+    elapsed = time.perf_counter() - start
+
+    stats = requests.get(f"{base}/twitter/stats").json()
+    served = sum(len(values) for values in latencies.values())
+    upstream = sum(mock.calls.values())
+    lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+    print(f"served {served} requests in {elapsed:.2f}s ({served / elapsed:.1f} req/s)")
+    for endpoint, values in latencies.items():
+        p50, p95, p99 = _percentiles(values)
+        print(f"  /twitter/{endpoint:<6} n={len(values):<6} p50={p50 * 1000:.1f}ms p95={p95 * 1000:.1f}ms p99={p99 * 1000:.1f}ms")
+    print(f"upstream calls: {upstream} ({upstream / max(served, 1):.3f} per served request) {mock.calls}")
+    print(f"tweet cache hit ratio: {(stats['hits'] + stats['disk_hits']) / max(lookups, 1):.3f} (coalesced {stats['coalesced']})")
+    api_server.shutdown()
+    mock_server.shutdown()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1 +1 @@
-from .endpoints import twitter_media as media, twitter_tweet as tweet, setup
\ No newline at end of file
+from .endpoints import twitter_media as media, twitter_tweet as tweet, export_media as export, warm_rest_ids as warm, setup
\ No newline at end of file
@@ -3,6 +3,54 @@ user_by_rest_id_query_id = "CO4_gU4G_MRREoqfiTh6Hg"
 user_media_query_id = "7_ZP_xN3Bcq1I2QkK5yc2w"
 tweet_query_id = "5GOHgZe-8U2j5sVHQzEm9A"
 
+graphql_url = "https://api.twitter.com/graphql"
+session_pool_size = 10
+session_connect_retries = 3
+session_retry_backoff = 0.5
+request_timeout = (5, 30)
+executor_workers = 16
+bulk_concurrency = 4
+account_race_width = 1
+account_schedule = "lru"
+rate_limit_reserve = 0
+rate_limit_fallback = 300
+prefetch_max_depth = 5
+prefetch_budget = 60
+prefetch_window = 60
+prefetch_ttl = 900
+cache_media_tweets = True
+tweet_cache_bytes = 256 * 1024 * 1024
+tweet_cache_ttl = 900
+tweet_cache_compress = False
+recache_size = 100000
+tweet_disk_cache_path = "cache.db"
+tweet_disk_cache_bytes = 1024 * 1024 * 1024
+tweet_disk_cache_ttl = 24 * 60 * 60
+tweet_disk_cache_evict_interval = 60
+shared_state_path = "cache.db"
+shared_reload_interval = 30
+metrics_publish_interval = 5
+metrics_worker_ttl = 60
+tweet_hedge = False
+tweet_hedge_percentile = 0.95
+tweet_hedge_min_delay = 0.05
+tweet_hedge_min_samples = 20
+tweet_hedge_budget = 0.05
+tweet_hedge_window = 1000
+visibility_refresh_interval = 30
+visibility_refresh_batch = 50
+visibility_refresh_reserve = 50
+visibility_refresh_stale = 6 * 60 * 60
+visibility_refresh_recent = 24 * 60 * 60
+visibility_refresh_tracked = 10000
+failure_cache_ttls = {
+    "NotFound": 24 * 60 * 60,
+    "UserUnavailable": 6 * 60 * 60,
+    "TweetUnavailable": 6 * 60 * 60
+}
+failure_cache_size = 100000
+failure_cache_persist = True
+
 user_by_screen_name_variables = {
     "withSafetyModeUserFields": True
 }
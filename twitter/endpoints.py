@@ -1,93 +1,331 @@
-from flask import Flask, request, current_app
-from cachetools import TTLCache
+from flask import Flask, Response, request, current_app, stream_with_context
+from cachetools import LRUCache, TLRUCache, TTLCache
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from .constants import *
 from .queries import *
-import urllib.parse
+from . import scheduler, graphql, metrics, queries
 import json
 import sqlite3
+import threading
+import zlib
+import hashlib
+import itertools
+import urllib.parse
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+try:
+    import orjson
+    _loads, _dumps = orjson.loads, orjson.dumps
+except ImportError:
+    _loads, _dumps = json.loads, lambda obj: json.dumps(obj).encode()
+
+_query_names = {value: name for name, value in vars(queries).items() if isinstance(value, str)}
 
 def _execute(con, *query):
+    start = time.perf_counter()
     cur = con.execute(*query)
     cur.close()
+    metrics.sqlite_query.observe(time.perf_counter() - start, query=_query_names.get(query[0], "other"))
 
 def _fetch_one(con, *query):
+    start = time.perf_counter()
     cur = con.execute(*query)
     row = cur.fetchone()
     cur.close()
+    metrics.sqlite_query.observe(time.perf_counter() - start, query=_query_names.get(query[0], "other"))
     return row
 
 def _fetch_all(con, *query):
+    start = time.perf_counter()
     cur = con.execute(*query)
     rows = cur.fetchall()
     cur.close()
+    metrics.sqlite_query.observe(time.perf_counter() - start, query=_query_names.get(query[0], "other"))
     return rows
 
-def setup():
+class _CountEvictions:
+    def __init__(self, metric, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metric = metric
+
+    def popitem(self):
+        item = super().popitem()
+        metrics.cache_evictions.inc(cache=self.metric, reason="size")
+        return item
+
+    def expire(self, *args):
+        expired = super().expire(*args)
+        if expired: metrics.cache_evictions.inc(len(expired), cache=self.metric, reason="ttl")
+        return expired
+
+class _TTLCache(_CountEvictions, TTLCache):
+    pass
+
+class _LRUCache(_CountEvictions, LRUCache):
+    pass
+
+class _TLRUCache(_CountEvictions, TLRUCache):
+    pass
+
+def _pack(data):
+    return zlib.compress(data, 1) if tweet_cache_compress else data
+
+def _unpack(data):
+    return zlib.decompress(data) if tweet_cache_compress else data
+
+def setup(shared=False):
     con = current_app.connect()
     con.executescript(create_tables).close()
+    if tweet_disk_cache_path:
+        current_app.connect(tweet_disk_cache_path).executescript(create_cache_tables).close()
+    if shared:
+        current_app.connect(shared_state_path).executescript(create_shared_tables).close()
+    if failure_cache_persist:
+        with con:
+            _execute(con, delete_expired_failures, (time.time(),))
     row_count = _fetch_one(con, select_account_count)
     if(row_count["count"] == 0):
         print("No twitter accounts, so not hosting /twitter/*")
         return
     current_app.add_url_rule("/twitter/media", view_func=twitter_media)
+    current_app.add_url_rule("/twitter/media/all", view_func=twitter_media_all)
     current_app.add_url_rule("/twitter/tweet", view_func=twitter_tweet)
+    current_app.add_url_rule("/twitter/tweets", view_func=twitter_tweets)
+    current_app.add_url_rule("/twitter/stats", view_func=twitter_stats)
+    current_app.add_url_rule("/twitter/warm", view_func=twitter_warm, methods=["GET", "POST"])
+    current_app.add_url_rule("/metrics", view_func=metrics.view)
     state = {
-        "timeout": TTLCache(maxsize = 100, ttl = 300),
-        "cache": TTLCache(maxsize = 2000, ttl = 900),
-        "recache": {}
+        "limits": {},
+        "cache": _TTLCache("cache", maxsize = tweet_cache_bytes, ttl = tweet_cache_ttl, getsizeof = len),
+        "cache_stats": {"hits": 0, "misses": 0, "disk_hits": 0, "coalesced": 0},
+        "flights": {},
+        "disk_evicted": 0,
+        "recache": _LRUCache("recache", maxsize = recache_size),
+        "recache_evicted": 0,
+        "hedge": {"latencies": deque(maxlen = tweet_hedge_window), "requests": 0, "hedges": 0},
+        "shared": shared,
+        "sessions": {},
+        "executor": ThreadPoolExecutor(max_workers = executor_workers),
+        "hedge_executor": ThreadPoolExecutor(max_workers = executor_workers),
+        "lock": threading.Lock(),
+        "pages": _TTLCache("pages", maxsize = 200, ttl = prefetch_ttl),
+        "prefetching": set(),
+        "prefetch_budget": TTLCache(maxsize = prefetch_budget, ttl = prefetch_window),
+        "accounts": _fetch_all(con, select_all_accounts),
+        "rest_ids": {row["display_name"]: int(row["rest_id"]) for row in _fetch_all(con, select_all_rest_ids)},
+        "blocks": {(row["blocked"], int(row["blocker"])) for row in _fetch_all(con, select_all_blocks)},
+        "privates": {int(row["rest_id"]) for row in _fetch_all(con, select_all_privates)},
+        "follows": {(row["follower"], int(row["followed"])) for row in _fetch_all(con, select_all_follows)},
+        "sync": {int(row["rest_id"]): row["newest_id"] for row in _fetch_all(con, select_all_syncs)},
+        "sync_pending": {},
+        "requested": TTLCache(maxsize = visibility_refresh_tracked, ttl = visibility_refresh_recent),
+        "checked": TTLCache(maxsize = visibility_refresh_tracked, ttl = visibility_refresh_stale),
+        "flagged": set(),
+        "suspect": set(),
+        "refresh_wake": threading.Event(),
+        "reloaded": TTLCache(maxsize = visibility_refresh_tracked, ttl = shared_reload_interval),
+        "failures": _TLRUCache("failures", maxsize = failure_cache_size, ttu = lambda key, value, now: value[2], timer = time.time)
     }
+    if failure_cache_persist:
+        for row in _fetch_all(con, select_all_failures, (time.time(),)):
+            state["failures"][(row["scope"], row["key"])] = (_loads(row["body"]), row["status"], row["expires"])
     current_app.state["twitter"] = state
+    threading.Thread(target=_refresh_visibility, args=(current_app._get_current_object(),), daemon=True).start()
+    if shared: threading.Thread(target=metrics.publisher, args=(current_app._get_current_object(),), daemon=True).start()
+
+def _session(account):
+    sessions = current_app.state["twitter"]["sessions"]
+    if account["account_id"] in sessions: return sessions[account["account_id"]]
+    session = requests.Session()
+    session.mount(graphql_url, HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=session_pool_size,
+        max_retries=Retry(
+            total=session_connect_retries,
+            connect=session_connect_retries,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=session_retry_backoff
+        )
+    ))
+    session.cookies.update({
+        "auth_token": account["auth_token"],
+        "ct0": account["csrf_token"]
+    })
+    session.headers.update({
+        "authorization": account["bearer_token"],
+        "x-csrf-token": account["csrf_token"]
+    })
+    return sessions.setdefault(account["account_id"], session)
+
+def _submit(fn, *args, executor="executor"):
+    app = current_app._get_current_object()
+    def run():
+        with app.app_context():
+            return fn(*args)
+    return current_app.state["twitter"][executor].submit(run)
+
+def _race(accounts, fn, *args):
+    if len(accounts) == 1:
+        yield accounts[0], fn(accounts[0], *args)
+        return
+    futures = {_submit(fn, account, *args): account for account in accounts}
+    for future in as_completed(futures):
+        yield futures[future], future.result()
+
+def _imap(fn, items, width):
+    #like _race, but keeps at most width calls in flight and yields (item, result) as each finishes
+    items = iter(items)
+    futures = {_submit(fn, item): item for item in itertools.islice(items, width)}
+    while futures:
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            item = futures.pop(future)
+            for following in itertools.islice(items, 1):
+                futures[_submit(fn, following)] = following
+            yield item, future.result()
+
+def _available_accounts(operation):
+    return scheduler.schedule(current_app.state["twitter"], current_app.state["twitter"]["accounts"], operation)
+
+def _lookup_rest_id(username):
+    state = current_app.state["twitter"]
+    with state["lock"]:
+        rest_id = state["rest_ids"].get(username)
+    if rest_id is None: #another worker, or api.py warm, may have resolved it since we started
+        row = _fetch_one(current_app.connect(), select_rest_id, (username,))
+        if row:
+            rest_id = int(row["rest_id"])
+            with state["lock"]:
+                state["rest_ids"][username] = rest_id
+    return rest_id
+
+def _insert_rest_id(con, username, rest_id):
+    with con: #connections live on with their thread, so never leave the write transaction open
+        _execute(con, insert_rest_id, (username, rest_id))
+    with current_app.state["twitter"]["lock"]:
+        current_app.state["twitter"]["rest_ids"][username] = int(rest_id)
+
+def _reload_creator(state, rest_id):
+    #with several workers, another one may have changed this creator's visibility since we last looked
+    with state["lock"]:
+        if rest_id in state["reloaded"]: return
+        state["reloaded"][rest_id] = True
+    con = current_app.connect()
+    blocked = {row["blocked"] for row in _fetch_all(con, select_blocks_for, (rest_id,))}
+    private = _fetch_one(con, select_private, (rest_id,)) is not None
+    follows = {row["follower"] for row in _fetch_all(con, select_follows_for, (rest_id,))}
+    with state["lock"]:
+        for account in state["accounts"]:
+            key = (account["account_id"], rest_id)
+            (state["blocks"].add if account["account_id"] in blocked else state["blocks"].discard)(key)
+            (state["follows"].add if account["account_id"] in follows else state["follows"].discard)(key)
+        (state["privates"].add if private else state["privates"].discard)(rest_id)
+
+def _accounts_for_creator(rest_id):
+    state = current_app.state["twitter"]
+    rest_id = int(rest_id)
+    if state["shared"]: _reload_creator(state, rest_id)
+    with state["lock"]:
+        state["requested"][rest_id] = True
+        private = rest_id in state["privates"]
+        accounts = [dict(account) | {
+            "validity": (account["account_id"], rest_id) not in state["blocks"] and (not private or (account["account_id"], rest_id) in state["follows"])
+                and (account["account_id"], rest_id) not in state["suspect"]
+        } for account in state["accounts"]]
+    accounts.sort(key=lambda account: not account["validity"])
+    return accounts
+
+def _single_flight(key, fn, *args):
+    #identical concurrent calls share the leader's successful (result, error) pair; after a failure each caller tries itself
+    state = current_app.state["twitter"]
+    with state["lock"]:
+        flight = state["flights"].get(key)
+        leader = flight is None
+        if leader: flight = state["flights"][key] = Future()
+    if not leader:
+        result = flight.result()
+        if result[1] is None:
+            with state["lock"]:
+                state["cache_stats"]["coalesced"] += 1
+            return result
+        return fn(*args)
+    result = None, 500
+    try:
+        result = fn(*args)
+    finally:
+        with state["lock"]:
+            del state["flights"][key]
+        flight.set_result(result)
+    return result
 
 def _request(path, params, account):
+    #answers depend on the account (blocks, follows, protected tweets), so only calls on the same account share one;
+    #the lookups callers make are coalesced again above account selection, see _resolve_rest_id, _media and _lookup_tweet
+    return _single_flight((path, params, account["account_id"]), _send, path, params, account)
+
+def _send(path, params, account):
+    state = current_app.state["twitter"]
+    operation = path.rsplit("/", 1)[-1]
+    scheduler.reserve(state, account["account_id"], operation)
+    start = time.perf_counter()
     try:
-        response = requests.get(
-            f"https://api.twitter.com/graphql/{path}",
+        response = _session(account).get(
+            f"{graphql_url}/{path}",
             params=params,
-            cookies={
-                "auth_token": account["auth_token"],
-                "ct0": account["csrf_token"]
-            },
-            headers={
-                "authorization": account["bearer_token"],
-                "x-csrf-token": account["csrf_token"]
-            }
+            timeout=request_timeout
         )
+    except Exception as e:
+        metrics.upstream_requests.inc(operation=operation, account=account["account_id"], status="error")
+        return None, 500
+    metrics.upstream_latency.observe(time.perf_counter() - start, operation=operation, account=account["account_id"])
+    metrics.upstream_requests.inc(operation=operation, account=account["account_id"], status=response.status_code)
+    if response.status_code == 429: metrics.rate_limited.inc(account=account["account_id"])
+    try:
+        scheduler.record(state, account["account_id"], operation, response.status_code, response.headers)
         if response.ok:
-            return response.json(), None
+            return _loads(response.content), None
         else:
-            return response.json(), response.status_code
+            return None, response.status_code
     except Exception as e:
         return None, 500
 
 
 def _update_visibility(result, con, account_id, rest_id):
-    if "blocked_by" in result["legacy"]:
-        _execute(con, insert_blocks, (account_id, rest_id))
-    else:
-        _execute(con, delete_blocks, (account_id, rest_id))
-    if "protected" in result["legacy"]:
-        _execute(con, insert_privates, (rest_id,))
-    else:
-        _execute(con, delete_privates, (rest_id,))
-    if "following" in result["legacy"]:
-        _execute(con, insert_follows, (account_id, rest_id))
-    else:
-        _execute(con, delete_follows, (account_id, rest_id))
-    return "blocked_by" not in result["legacy"] and ("following" in result["legacy"] or "protected" not in result["legacy"])
+    visible, changes = _visibility_changes(result, account_id, rest_id)
+    if changes:
+        with con:
+            for query in changes:
+                _execute(con, *query)
+    return visible
+
+def _visibility_changes(result, account_id, rest_id):
+    state = current_app.state["twitter"]
+    rest_id = int(rest_id)
+    blocked = "blocked_by" in result["legacy"]
+    private = "protected" in result["legacy"]
+    following = "following" in result["legacy"]
+    #only write what differs from the index, all in one transaction; with several workers the index may be stale, so write it all
+    changes = []
+    shared = state["shared"]
+    with state["lock"]:
+        if shared or blocked != ((account_id, rest_id) in state["blocks"]):
+            (state["blocks"].add if blocked else state["blocks"].discard)((account_id, rest_id))
+            changes.append((insert_blocks if blocked else delete_blocks, (account_id, rest_id)))
+        if shared or private != (rest_id in state["privates"]):
+            (state["privates"].add if private else state["privates"].discard)(rest_id)
+            changes.append((insert_privates if private else delete_privates, (rest_id,)))
+        if shared or following != ((account_id, rest_id) in state["follows"]):
+            (state["follows"].add if following else state["follows"].discard)((account_id, rest_id))
+            changes.append((insert_follows if following else delete_follows, (account_id, rest_id)))
+    return not blocked and (following or not private), changes
 
 def _request_visibility(con, account, rest_id):
-    response, error = _request(
-        f"{user_by_rest_id_query_id}/UserByRestId",
-        urllib.parse.urlencode({
-            "variables": json.dumps(
-                user_by_rest_id_variables |
-                {"userId": rest_id}
-            ),
-            "features" : json.dumps(user_by_rest_id_features)
-        }),
-        account
-    )
+    response, error = _request(*graphql.user_by_rest_id(rest_id), account)
     if error is None:
         if not response["data"]["user"]: 
             return None, "user does not exist"
@@ -96,45 +334,119 @@ def _request_visibility(con, account, rest_id):
         else:
             return False, None
     else:
-        if error == 429:
-            current_app.state["twitter"]["timeout"][account["account_id"]] = True
-        return None, response.status_code
-
-def _request_media(con, account, rest_id):
-    if account["account_id"] in current_app.state["twitter"]["timeout"]: return False
-    response, error = _request(
-        f"{user_media_query_id}/UserMedia",
-        urllib.parse.urlencode({
-            "variables": json.dumps(
-                user_media_variables |
-                {"userId": rest_id} |
-                ({"cursor": request.args["cursor"]} if "cursor" in request.args else {})
-            ),
-            "features" : json.dumps(user_media_features)
-        }),
-        account
-    )
+        return None, error
+
+def _flag_visibility(rest_id, account_id=None):
+    #hands the recheck to the refresher, and keeps the account out of the way for this creator until then
+    state = current_app.state["twitter"]
+    rest_id = int(rest_id)
+    with state["lock"]:
+        if account_id is None and rest_id in state["checked"] and not any(suspect[1] == rest_id for suspect in state["suspect"]):
+            return #nothing new since the last check; the next scheduled recheck will pick it up
+        state["flagged"].add(rest_id)
+        if account_id is not None: state["suspect"].add((account_id, rest_id))
+    state["refresh_wake"].set()
+
+def _refresh_visibility(app):
+    #background worker: rechecks flagged creators first, then recently requested ones gone stale, on spare UserByRestId budget
+    with app.app_context():
+        state = current_app.state["twitter"]
+        while True:
+            state["refresh_wake"].wait(visibility_refresh_interval)
+            state["refresh_wake"].clear()
+            try:
+                _refresh_round(state)
+            except Exception as e:
+                current_app.log(f"visibility refresh failed: {e}", level="error")
+
+def _refresh_round(state):
+    with state["lock"]:
+        due = list(state["flagged"]) + [rest_id for rest_id in state["requested"] if rest_id not in state["checked"] and rest_id not in state["flagged"]]
+    con = current_app.connect()
+    calls = 0
+    for rest_id in due:
+        accounts = scheduler.schedule(state, state["accounts"], "UserByRestId", visibility_refresh_reserve)
+        if not accounts or (calls and calls + len(accounts) > visibility_refresh_batch): return
+        answered = False
+        for account in accounts:
+            calls += 1
+            visibility, error = _request_visibility(con, account, str(rest_id))
+            if visibility is not None:
+                answered = True
+                with state["lock"]:
+                    state["suspect"].discard((account["account_id"], rest_id))
+            elif error == "user does not exist":
+                answered = True
+        #when every call failed (429s, 500s) the creator stays flagged for the next round
+        if answered:
+            with state["lock"]:
+                state["flagged"].discard(rest_id)
+                state["checked"][rest_id] = True
+
+def _failure(scope, key):
+    #a recent permanent-looking failure is answered again without spending upstream quota
+    state = current_app.state["twitter"]
+    with state["lock"]:
+        failure = state["failures"].get((scope, str(key)))
+    if failure is None and state["shared"] and failure_cache_persist: #another worker may have recorded it
+        row = _fetch_one(current_app.connect(), select_failure, (scope, str(key), time.time()))
+        if row:
+            failure = (_loads(row["body"]), row["status"], row["expires"])
+            with state["lock"]:
+                state["failures"][(scope, str(key))] = failure
+    metrics.cache_requests.inc(cache="failures", result="hit" if failure is not None else "miss")
+    return failure[:2] if failure is not None else None
+
+def _remember_failure(scope, key, kind, body, status):
+    state = current_app.state["twitter"]
+    expires = time.time() + failure_cache_ttls[kind]
+    with state["lock"]:
+        state["failures"][(scope, str(key))] = (body, status, expires)
+    if failure_cache_persist:
+        con = current_app.connect()
+        with con:
+            _execute(con, insert_failure, (scope, str(key), kind, _dumps(body).decode(), status, expires))
+
+def _fetch_media(account, rest_id, cursor):
+    return _request(*graphql.user_media(rest_id, cursor), account)
+
+def _media_timeline(instructions):
+    #single pass over the timeline, picking out only the tweet items and the bottom cursor
+    entries = None
+    tweets = None
+    for instruction in instructions:
+        if instruction["type"] == "TimelineAddEntries" and entries is None:
+            entries = instruction["entries"]
+        elif instruction["type"] == "TimelineAddToModule" and tweets is None:
+            tweets = instruction["moduleItems"]
+    bottom_cursor = None
+    for entry in entries:
+        match entry["content"]:
+            case {"__typename": "TimelineTimelineModule", "items": items} if tweets is None:
+                tweets = items
+            case {"__typename": "TimelineTimelineCursor", "cursorType": "Bottom", "value": value} if bottom_cursor is None:
+                bottom_cursor = value
+    if bottom_cursor is None: raise ValueError("UserMedia timeline has no bottom cursor")
+    return tweets if tweets is not None else [], bottom_cursor
+
+def _request_media(con, account, rest_id, cursor, cache):
+    if scheduler.exhausted(current_app.state["twitter"], account["account_id"], "UserMedia"): return None, 429
+    return _parse_media(con, account, rest_id, cursor, cache, *_fetch_media(account, rest_id, cursor))
+
+def _parse_media(con, account, rest_id, cursor, cache, response, error):
     if error is None:
-        if "debug" in request.args: return response, None
-        if not response["data"]: return {"note": "user not found"}, 404
-        if not response["data"]["user"]: #blocked or privated; recheck visibility
-            visibility, error = _request_visibility(con, account, rest_id)
-            if error is None:
-                if visibility:
-                    current_app.log(f"visibility returned unexpected result for account id {account['account_id']} and rest id {rest_id}")
-                else:
-                    return None, "invisible"
-            else:
-                return None, error
+        if not response["data"]:
+            _remember_failure("rest_id", rest_id, "NotFound", {"note": "user not found"}, 404)
+            return {"note": "user not found"}, 404
+        if not response["data"]["user"]: #blocked or privated
+            _flag_visibility(rest_id, account["account_id"])
+            return None, "invisible"
         if response["data"]["user"]["result"]["__typename"] == "UserUnavailable":
             return None, "UserUnavailable"
-        instructions = response["data"]["user"]["result"]["timeline_v2"]["timeline"]["instructions"]
-        entries = next(x["entries"] for x in instructions if x["type"] == "TimelineAddEntries")
-        tweets = next((x["moduleItems"] for x in instructions if x["type"] == "TimelineAddToModule"),
-            next((x["content"]["items"] for x in entries if x["content"]["__typename"] == "TimelineTimelineModule"),
-            []))
-        bottom_cursor = next(x for x in entries if x["content"]["__typename"] == "TimelineTimelineCursor" and x["content"]["cursorType"] == "Bottom")["content"]["value"]
+        tweets, bottom_cursor = _media_timeline(response["data"]["user"]["result"]["timeline_v2"]["timeline"]["instructions"])
+        if not tweets: bottom_cursor = None #end of the timeline; a page of only unavailable tweets still has a next page
         tweet_ids = []
+        encoded = []
         for item in tweets:
             if "result" not in item["item"]["itemContent"]["tweet_results"]: continue
             tweet = item["item"]["itemContent"]["tweet_results"]["result"]
@@ -144,77 +456,195 @@ def _request_media(con, account, rest_id):
                 case "TweetWithVisibilityResults":
                     tweet = tweet["tweet"]
                 case "TweetUnavailable":
-                    current_app.log(f"error reading unavailable tweet at rest id {rest_id} and cursor {request.args['cursor']}")
-                    current_app.log(json.dumps(tweet))
+                    current_app.log(f"error reading unavailable tweet at rest id {rest_id} and cursor {cursor}", level="warning", payload=tweet)
                     continue
                 case "TweetTombstone":
-                    current_app.log(f"error reading circle tweet at rest id {rest_id} and cursor {request.args['cursor']}")
-                    current_app.log(json.dumps(tweet))
+                    current_app.log(f"error reading circle tweet at rest id {rest_id} and cursor {cursor}", level="warning", payload=tweet)
                     continue
                 case _:
-                    current_app.log(f"Unexpected json structure in response at rest id {rest_id} and cursor {request.args['cursor']}")
-                    current_app.log(json.dumps(tweet))
+                    current_app.log(f"Unexpected json structure in response at rest id {rest_id} and cursor {cursor}", level="error", payload=tweet)
                     continue
             tweet_id = tweet["rest_id"]
-            if "locked" in request.args:
-                current_app.state["twitter"]["cache"][tweet_id] = tweet
-                current_app.state["twitter"]["recache"][tweet_id] = (current_app.state["twitter"]["user_ids"][username], request.args["cursor"] if "cursor" in request.args else None)
+            data = _dumps(tweet)
+            if cache:
+                with current_app.state["twitter"]["lock"]:
+                    try:
+                        current_app.state["twitter"]["cache"][tweet_id] = _pack(data)
+                    except ValueError: #larger than the whole cache budget
+                        pass
+                    current_app.state["twitter"]["recache"][tweet_id] = (rest_id, cursor)
+            encoded.append((tweet_id, data))
             tweet_ids.append(tweet_id)
-        return {"tweet_ids": tweet_ids, "next_page": f"media?username={request.args['username']}&cursor={bottom_cursor}"}, None
+        if cache:
+            _disk_put(encoded)
+            _recache_put(tweet_ids, rest_id, cursor)
+        return (tweet_ids, bottom_cursor, encoded), None
     else:
-        if error == 429:
-            current_app.state["twitter"]["timeout"][account["account_id"]] = True
         return None, error
 
-def twitter_media():
-    with current_app.connect() as con:
-        username = request.args["username"]
-        rest_id = None
-
-        #get rest_id for username
-        res = _fetch_one(con, select_rest_id, (username,))
-        if res is None:
-            accounts = _fetch_all(con, select_all_accounts)
-            for account in accounts:
-                if account["account_id"] in current_app.state["twitter"]["timeout"]: continue
-                response, error = _request(
-                    f"{user_by_screen_name_query_id}/UserByScreenName",
-                    urllib.parse.urlencode({
-                        "variables": json.dumps(
-                            user_by_screen_name_variables |
-                            {"screen_name": username}
-                        ),
-                        "features" : json.dumps(user_by_screen_name_features)
-                        }),
-                    account
-                )
-                if error is None:
-                    if not response["data"]: return {"note": "user not found"}, 404
-                    match response["data"]["user"]["result"]["__typename"]:
-                        case "User":
-                            rest_id = response["data"]["user"]["result"]["rest_id"]
-                            _execute(con, insert_rest_id, (username, rest_id))
-                            _update_visibility(response["data"]["user"]["result"], con, account["account_id"], rest_id)
-                            break
-                        case "UserUnavailable":
-                            return {"note": response["data"]["user"]["result"]["message"]}
-                        case _:
-                            current_app.log(f"Unexpected structure {response['data']['user']['result']['__typename']} in UserByScreenName response for user {username}")
-                elif error == 429:
-                    current_app.state["twitter"]["timeout"][account["account_id"]] = True
-                    continue
-                else:
-                    return {"note": str(error)}
+def _media_page(tweet_ids, bottom_cursor):
+    if bottom_cursor is None: return _json_response(_dumps({"tweet_ids": tweet_ids}))
+    #next_page keeps the caller's options (prefetch, incremental, locked) so they apply to the whole walk
+    options = [(key, value) for key, value in request.args.items(multi=True) if key != "cursor"]
+    return _json_response(_dumps({"tweet_ids": tweet_ids, "next_page": "media?" + urllib.parse.urlencode(options + [("cursor", bottom_cursor)])}))
+
+def _sync_page(con, rest_id, cursor, tweet_ids, bottom_cursor):
+    #drops tweets at or below the high-water mark; the mark only moves once a sync has paged all the way down to it
+    state = current_app.state["twitter"]
+    rest_id = int(rest_id)
+    if state["shared"]: #the pages of one sync may be served by different workers, so the mark and pending mark live in master.db
+        row = _fetch_one(con, select_sync, (rest_id, rest_id))
+        with state["lock"]:
+            if row["newest_id"] is not None: state["sync"][rest_id] = row["newest_id"]
+            if row["pending"] is not None: state["sync_pending"][rest_id] = row["pending"]
+            else: state["sync_pending"].pop(rest_id, None)
+    changes = []
+    with state["lock"]:
+        mark = state["sync"].get(rest_id)
+        if cursor is None and tweet_ids:
+            state["sync_pending"][rest_id] = max(int(tweet_id) for tweet_id in tweet_ids)
+            changes.append((insert_sync_pending, (rest_id, state["sync_pending"][rest_id])))
+        newer = [tweet_id for tweet_id in tweet_ids if mark is None or int(tweet_id) > mark]
+        done = bottom_cursor is None or len(newer) < len(tweet_ids)
+        pending = state["sync_pending"].pop(rest_id, None) if done else None
+        if done: changes.append((delete_sync_pending, (rest_id,)))
+        if pending is not None and (mark is None or pending > mark):
+            state["sync"][rest_id] = pending
+            changes.append((insert_sync, (rest_id, pending, time.time())))
+    if not state["shared"]: changes = [change for change in changes if change[0] == insert_sync]
+    if changes:
+        with con:
+            for query in changes:
+                _execute(con, *query)
+    return newer, done
+
+def _prefetch(account, rest_id, username, cursor, depth):
+    state = current_app.state["twitter"]
+    with state["lock"]:
+        while depth > 0 and (str(rest_id), cursor) in state["pages"]:
+            tweet_ids, cursor, account = state["pages"][(str(rest_id), cursor)]
+            depth -= 1
+        if cursor is None: return
+        if depth <= 0 or (str(rest_id), cursor) in state["prefetching"]: return
+        if not scheduler.available(state, account["account_id"], "UserMedia"): return
+        if len(state["prefetch_budget"]) >= state["prefetch_budget"].maxsize: return
+        state["prefetch_budget"][(str(rest_id), cursor)] = True
+        state["prefetching"].add((str(rest_id), cursor))
+    _submit(_prefetch_page, account, rest_id, username, cursor, depth)
+
+def _prefetch_page(account, rest_id, username, cursor, depth):
+    state = current_app.state["twitter"]
+    try:
+        with current_app.connect() as con:
+            response, error = _request_media(con, account, rest_id, cursor, True)
+        if error is None:
+            tweet_ids, bottom_cursor, _ = response
+            with state["lock"]:
+                state["pages"][(str(rest_id), cursor)] = (tweet_ids, bottom_cursor, account)
+            _prefetch(account, rest_id, username, bottom_cursor, depth - 1)
+    finally:
+        with state["lock"]:
+            state["prefetching"].discard((str(rest_id), cursor))
+
+def _prefetched(rest_id, cursor):
+    state = current_app.state["twitter"]
+    with state["lock"]:
+        return state["pages"].pop((str(rest_id), cursor), None)
+
+def _resolve_rest_id(con, username):
+    rest_id = _lookup_rest_id(username)
+    if rest_id is not None: return rest_id, None
+    #coalesced before an account is picked, since the scheduler hands each concurrent caller a different one
+    return _single_flight(("UserByScreenName", username), _resolve_new_rest_id, con, username)
+
+def _resolve_new_rest_id(con, username):
+    resolved, error = _fetch_user(username)
+    if error is not None: return None, error
+    result, account = resolved
+    _insert_rest_id(con, username, result["rest_id"])
+    _update_visibility(result, con, account["account_id"], result["rest_id"])
+    return result["rest_id"], None
+
+def _fetch_user(username):
+    failure = _failure("user", username)
+    if failure is not None: return None, failure
+    for account in _available_accounts("UserByScreenName"):
+        response, error = _request(*graphql.user_by_screen_name(username), account)
+        if error is None:
+            if not response["data"]:
+                _remember_failure("user", username, "NotFound", {"note": "user not found"}, 404)
+                return None, ({"note": "user not found"}, 404)
+            match response["data"]["user"]["result"]["__typename"]:
+                case "User":
+                    return (response["data"]["user"]["result"], account), None
+                case "UserUnavailable":
+                    _remember_failure("user", username, "UserUnavailable", {"note": response["data"]["user"]["result"]["message"]}, 200)
+                    return None, {"note": response["data"]["user"]["result"]["message"]}
+                case _:
+                    current_app.log(f"Unexpected structure {response['data']['user']['result']['__typename']} in UserByScreenName response for user {username}", level="error")
+        elif error == 429:
+            continue
         else:
-            rest_id = res["rest_id"]
+            return None, {"note": str(error)}
+    return None, ({"note": f"no account could resolve {username}"}, 503)
+
+def warm_rest_ids(usernames):
+    #resolves many screen names concurrently and writes them back in one transaction, so a first page costs only its UserMedia call
+    state = current_app.state["twitter"]
+    usernames = list(dict.fromkeys(usernames))
+    unknown = [username for username in usernames if _lookup_rest_id(username) is None]
+    resolved = {}
+    failed = {}
+    changes = []
+    for username, (found, error) in _imap(_fetch_user, unknown, bulk_concurrency):
+        if error is not None:
+            failed[username] = error[0]["note"] if isinstance(error, tuple) else error["note"]
+            continue
+        result, account = found
+        resolved[username] = int(result["rest_id"])
+        changes.append((insert_rest_id, (username, result["rest_id"])))
+        changes += _visibility_changes(result, account["account_id"], result["rest_id"])[1]
+    if changes:
+        con = current_app.connect()
+        with con:
+            for query in changes:
+                _execute(con, *query)
+    #the refresher then fills in visibility for the remaining accounts in the background
+    with state["lock"]:
+        state["rest_ids"].update(resolved)
+        for rest_id in resolved.values():
+            state["requested"][rest_id] = True
+    state["refresh_wake"].set()
+    return {"known": len(usernames) - len(unknown), "resolved": len(resolved), "failed": failed}
 
-        #get valid accounts for user & attempt to query
-        accounts = _fetch_all(con, select_accounts_for_creator, (rest_id,))
-        valid_accounts = [account for account in accounts if account["validity"]]
-        for account in valid_accounts:
-            response, error = _request_media(con, account, rest_id)
+def twitter_warm():
+    usernames = request.get_json(force=True, silent=True) if request.data else request.args["usernames"].split(",")
+    if not isinstance(usernames, list) or not all(isinstance(username, str) for username in usernames):
+        return {"note": "expected a json list of screen names"}, 400
+    return warm_rest_ids([username.strip().lstrip("@") for username in usernames if username.strip()])
+
+def _media(con, username, rest_id, cursor, cache, debug=False):
+    if debug: return _media_from_accounts(con, username, rest_id, cursor, cache, True)
+    return _single_flight(("UserMedia", str(rest_id), cursor, bool(cache)), _media_from_accounts, con, username, rest_id, cursor, cache)
+
+def _media_from_accounts(con, username, rest_id, cursor, cache, debug=False):
+    failure = _failure("rest_id", rest_id)
+    if failure is not None: return None, failure
+    #get valid accounts for user & attempt to query
+    accounts = _accounts_for_creator(rest_id)
+    valid_accounts = [account for account in accounts if account["validity"]]
+    if valid_accounts:
+        valid_accounts = scheduler.schedule(current_app.state["twitter"], valid_accounts, "UserMedia")
+        if not valid_accounts: return None, ({"note": "all accounts are rate limited"}, 429)
+    tried = 0
+    for i in range(0, len(valid_accounts), account_race_width):
+        for account, fetched in _race(valid_accounts[i:i + account_race_width], _fetch_media, rest_id, cursor):
+            tried += 1
+            if debug and fetched[1] is None: return fetched[0], None
+            response, error = _parse_media(con, account, rest_id, cursor, cache, *fetched)
             if error is None:
-                return response
+                metrics.fallback_depth.observe(tried)
+                return response + (account,), None
             else:
                 match error:
                     case 429:
@@ -222,95 +652,289 @@ def twitter_media():
                     case "invisible":
                         continue
                     case "UserUnavailable":
-                        return {"note": str(error)}
+                        _remember_failure("rest_id", rest_id, "UserUnavailable", {"note": str(error)}, 200)
+                        return None, {"note": str(error)}
                     case _:
-                        current_app.log(error, " at ", username, ", ", request.args["cursor"] if "cursor" in request.args else "(no cursor)")
-                        return {"note": str(error)}
-        
-        current_app.log(f"accounts for {rest_id} blocked!")
-
-        #the account we thought was valid is no longer valid, recheck all other accounts before giving up
-        other_accounts = [account for account in accounts if not account["validity"]]
-        for account in other_accounts:
-            visibility, error = _request_visibility(con, account, rest_id)
-            if visibility:
-                response, error = _request_media(con, account, rest_id)
-                if error is None:
-                    return response
-                else:
-                    match error:
-                        case 429:
-                            continue
-                        case "invisible":
-                            continue
-                        case _:
-                            current_app.log(error, " at ", username, ", ", request.args["cursor"] if "cursor" in request.args else "(no cursor)")
-                            return {"note": str(error)}
-            else:
-                return {"note": str(error)}
-        current_app.log(f"no accounts for {rest_id} were successful!")
+                        current_app.log(error, "at", username, cursor or "(no cursor)", level="error")
+                        return None, {"note": str(error)}
 
-        return {"note": "account blocked or protected"}
+    #no account known to see this creator got through; the refresher rechecks the others off the request path
+    current_app.log(f"accounts for {rest_id} blocked!", level="warning")
+    _flag_visibility(rest_id)
+    return None, {"note": "account blocked or protected"}
 
-def twitter_tweet():
+def twitter_media():
     with current_app.connect() as con:
-        tweet_id = request.args["tweet"]
-        local_idx = current_app.state["twitter"]["idx"]
-        if tweet_id in current_app.state["twitter"]["cache"]: return current_app.state["twitter"]["cache"].pop(tweet_id)
-        elif tweet_id in current_app.state["twitter"]["recache"]:
-            user_id, cursor = current_app.state["twitter"]["recache"][tweet_id]
-            response, error = _request(
-                f"{user_media_query_id}/UserMedia",
-                urllib.parse.urlencode({
-                    "variables": json.dumps(
-                        user_media_variables |
-                        {"userId": user_id} |
-                        ({"cursor": cursor} if cursor else {})
-                    ),
-                    "features" : json.dumps(user_media_features)
-                }),
-                local_idx
-            )
-            if error is None:
-                entries = response["data"]["user"]["result"]["timeline_v2"]["timeline"]["instructions"][0]["entries"]
-                tweet_entries = [entry for entry in entries if (entry["content"]["__typename"] == "TimelineTimelineItem" and entry["content"]["itemContent"]["tweet_results"])]
-                bottom_cursor = entries[-1]["content"]["value"]
-                for entry in tweet_entries:
-                    if "result" not in entry["content"]["itemContent"]["tweet_results"]: continue
-                    tweet = entry["content"]["itemContent"]["tweet_results"]["result"]
-                    match tweet["__typename"]:
-                        case "Tweet": 
-                            current_app.state["twitter"]["cache"][tweet_id] = tweet
-                        case "TweetWithVisibilityResults":
-                            current_app.state["twitter"]["cache"][tweet_id] = tweet["tweet"]
-                        case "TweetUnavailable":
-                            current_app.log(f"error reading protected tweet: {tweet_id}")
-                        case _:
-                            current_app.log("Unexpected json structure in response!")
-                            current_app.log(response.json().dumps())
-            if tweet_id in current_app.state["twitter"]["cache"]: return current_app.state["twitter"]["cache"].pop(tweet_id)
-        response, error = _request(
-            f"{tweet_query_id}/TweetResultByRestId",
-            urllib.parse.urlencode({
-                "variables": json.dumps(
-                    tweet_variables |
-                    {"tweetId": tweet_id}
-                ),
-                "features" : json.dumps(tweet_features)
-            }),
-            local_idx
-        )
-        if error is None:
-            if "debug" in request.args: return response_json
-            match response["data"]["tweetResult"]["result"]["__typename"]:
-                case "Tweet": return response["data"]["tweetResult"]["result"]
-                case "TweetWithVisibilityResults": return response["data"]["tweetResult"]["result"]["tweet"]
-                case "TweetUnavailable":
-                    current_app.log(f"error reading protected tweet: {tweet_id}")
-                    return {"note": result["reason"]}, error
-                case _:
-                    current_app.log("Unexpected json structure in response!")
-                    current_app.log(response)
-                    return response
+        username = request.args["username"]
+        rest_id, error = _resolve_rest_id(con, username)
+        if error is not None: return error
+
+        cursor = request.args.get("cursor")
+        depth = min(int(request.args.get("prefetch", 0)), prefetch_max_depth)
+
+        #serve the page from the prefetcher if it got there first
+        page = _prefetched(rest_id, cursor) if "debug" not in request.args else None
+        if page is not None:
+            tweet_ids, bottom_cursor, account = page
         else:
-            return {"note": str(error)}, error
\ No newline at end of file
+            page, error = _media(con, username, rest_id, cursor, cache_media_tweets or "locked" in request.args, "debug" in request.args)
+            if error is not None: return error
+            if "debug" in request.args: return page
+            tweet_ids, bottom_cursor, _, account = page
+
+        #with incremental, stop handing out next_page once tweets already seen by a previous sync turn up
+        if "incremental" in request.args:
+            tweet_ids, done = _sync_page(con, rest_id, cursor, tweet_ids, bottom_cursor)
+            if done: return _media_page(tweet_ids, None)
+        _prefetch(account, rest_id, username, bottom_cursor, depth)
+        return _media_page(tweet_ids, bottom_cursor)
+
+def export_media(username, since_id=None, cursor=None):
+    #walks the whole bottom_cursor chain, yielding one ndjson line per tweet as each page is parsed
+    con = current_app.connect()
+    rest_id, error = _resolve_rest_id(con, username)
+    while error is None:
+        page, error = _media(con, username, rest_id, cursor, False)
+        if error is not None: break
+        tweet_ids, bottom_cursor, tweets, _ = page
+        for tweet_id, data in tweets:
+            if since_id is not None and int(tweet_id) <= int(since_id): return
+            yield data + b"\n"
+        if bottom_cursor is None or bottom_cursor == cursor: return
+        cursor = bottom_cursor
+    #the cursor of the failed page, so the export can be resumed with cursor=/--cursor
+    yield _dumps((error[0] if isinstance(error, tuple) else error) | {"cursor": cursor}) + b"\n"
+
+def twitter_media_all():
+    return Response(stream_with_context(export_media(request.args["username"], request.args.get("since_id"), request.args.get("cursor"))), mimetype="application/x-ndjson")
+
+def _cached_tweet(tweet_id, count_miss=True):
+    state = current_app.state["twitter"]
+    with state["lock"]:
+        tweet = state["cache"].pop(tweet_id, None)
+        if tweet is not None:
+            state["cache_stats"]["hits"] += 1
+            metrics.cache_requests.inc(cache="memory", result="hit")
+            return _unpack(tweet)
+    metrics.cache_requests.inc(cache="memory", result="miss")
+    tweet = _disk_get(tweet_id)
+    if tweet_disk_cache_path: metrics.cache_requests.inc(cache="disk", result="hit" if tweet is not None else "miss")
+    with state["lock"]:
+        if tweet is not None:
+            state["cache_stats"]["disk_hits"] += 1
+        elif count_miss:
+            state["cache_stats"]["misses"] += 1
+    return tweet
+
+def _disk_get(tweet_id):
+    if not tweet_disk_cache_path: return None
+    row = _fetch_one(current_app.connect(tweet_disk_cache_path), select_cached_tweet, (tweet_id, time.time() - tweet_disk_cache_ttl))
+    return row["tweet"] if row else None
+
+def _disk_put(tweets):
+    if not tweet_disk_cache_path or not tweets: return
+    state = current_app.state["twitter"]
+    now = time.time()
+    rows = [(tweet_id, data, len(data), now) for tweet_id, data in tweets]
+    with current_app.connect(tweet_disk_cache_path) as con:
+        con.executemany(insert_cached_tweet, rows).close()
+        with state["lock"]:
+            evict = now - state["disk_evicted"] > tweet_disk_cache_evict_interval
+            if evict: state["disk_evicted"] = now
+        if evict:
+            _execute(con, delete_expired_cached_tweets, (now - tweet_disk_cache_ttl,))
+            _execute(con, delete_oversized_cached_tweets, (tweet_disk_cache_bytes,))
+
+def _recache_put(tweet_ids, rest_id, cursor):
+    state = current_app.state["twitter"]
+    if not state["shared"] or not tweet_ids: return
+    now = time.time()
+    with current_app.connect(shared_state_path) as con:
+        con.executemany(insert_recache, [(tweet_id, rest_id, cursor, now) for tweet_id in tweet_ids]).close()
+        with state["lock"]:
+            evict = now - state["recache_evicted"] > tweet_disk_cache_evict_interval
+            if evict: state["recache_evicted"] = now
+        if evict:
+            _execute(con, delete_overflowing_recache, (recache_size,))
+
+def _recache_get(tweet_id):
+    state = current_app.state["twitter"]
+    with state["lock"]:
+        page = state["recache"].get(tweet_id)
+    if page is None and state["shared"]:
+        row = _fetch_one(current_app.connect(shared_state_path), select_recache, (tweet_id,))
+        if row: page = (row["rest_id"], row["cursor"])
+    return page
+
+def twitter_stats():
+    state = current_app.state["twitter"]
+    with state["lock"]:
+        return state["cache_stats"] | {
+            "cached_tweets": len(state["cache"]),
+            "cache_bytes": state["cache"].currsize,
+            "cache_budget": state["cache"].maxsize,
+            "recached_tweets": len(state["recache"]),
+            "remembered_failures": len(state["failures"])
+        }
+
+def _json_response(data):
+    #already-encoded json goes out as is, with a strong etag so hydrus can revalidate for free
+    response = Response(data, mimetype="application/json")
+    response.set_etag(hashlib.blake2b(data, digest_size=16).hexdigest())
+    return response.make_conditional(request)
+
+def _recache_page(page):
+    #re-read the whole media page a tweet was seen on, which caches its neighbours too
+    user_id, cursor = page
+    accounts = [account for account in _accounts_for_creator(user_id) if account["validity"]]
+    accounts = scheduler.schedule(current_app.state["twitter"], accounts, "UserMedia")
+    if accounts:
+        _request_media(current_app.connect(), accounts[0], user_id, cursor, True)
+
+def _recached_tweet(tweet_id):
+    page = _recache_get(tweet_id)
+    if page is None: return None
+    _recache_page(page)
+    tweet = _cached_tweet(tweet_id, False)
+    metrics.cache_requests.inc(cache="recache", result="hit" if tweet is not None else "miss")
+    return tweet
+
+def _timed_request(path, params, account):
+    start = time.perf_counter()
+    result = _request(path, params, account)
+    if result[1] is None:
+        state = current_app.state["twitter"]
+        with state["lock"]:
+            state["hedge"]["latencies"].append(time.perf_counter() - start)
+    return result
+
+def _hedge_delay(hedge):
+    latencies = sorted(hedge["latencies"])
+    if len(latencies) < tweet_hedge_min_samples: return None
+    return max(latencies[int(len(latencies) * tweet_hedge_percentile)], tweet_hedge_min_delay)
+
+def _hedged(path, params, accounts):
+    #once the first call is slower than tweet_hedge_percentile of recent ones, the same call goes out on the next account;
+    #both attempts run on their own pool, since /twitter/tweets already calls this from the shared executor
+    state = current_app.state["twitter"]
+    hedge = state["hedge"]
+    first = _submit(_timed_request, path, params, accounts[0], executor="hedge_executor")
+    with state["lock"]:
+        if hedge["requests"] >= tweet_hedge_window: #let the budget follow recent traffic
+            hedge["requests"] //= 2
+            hedge["hedges"] //= 2
+        hedge["requests"] += 1
+        delay = _hedge_delay(hedge)
+        if delay is None or len(accounts) < 2 or hedge["hedges"] >= tweet_hedge_budget * hedge["requests"]:
+            delay = None
+    if delay is None: return first.result()
+    done, _ = wait([first], timeout=delay)
+    if done: return first.result()
+    with state["lock"]:
+        hedge["hedges"] += 1
+    #bypasses single-flight, which would only wait on the first call again; the slower call is left to finish unused
+    second = _submit(_send, path, params, accounts[1], executor="hedge_executor")
+    winners = {first: "first", second: "hedge"}
+    result = None, 500
+    for future in as_completed(winners):
+        result = future.result()
+        if result[1] is None:
+            metrics.hedged_requests.inc(winner=winners[future])
+            return result
+    metrics.hedged_requests.inc(winner="none")
+    return result
+
+def _lookup_tweet(tweet_id):
+    return _single_flight(("TweetResultByRestId", str(tweet_id)), _fetch_tweet, tweet_id)
+
+def _fetch_tweet(tweet_id):
+    failure = _failure("tweet", tweet_id)
+    if failure is not None: return failure
+    accounts = _available_accounts("TweetResultByRestId")
+    if not accounts: return {"note": "all accounts are rate limited"}, 429
+    if tweet_hedge:
+        response, error = _hedged(*graphql.tweet(tweet_id), accounts)
+    else:
+        response, error = _request(*graphql.tweet(tweet_id), accounts[0])
+    if error is not None: return {"note": str(error)}, error
+    #a protected tweet is only unavailable to accounts that don't follow its creator, so the others get a turn first
+    for account in accounts[1:]:
+        result = response["data"]["tweetResult"].get("result", {})
+        if result.get("__typename") != "TweetUnavailable" or result.get("reason") != "Protected": break
+        retry, error = _request(*graphql.tweet(tweet_id), account)
+        if error is not None: break
+        response = retry
+    if "result" not in response["data"]["tweetResult"]: #deleted
+        _remember_failure("tweet", tweet_id, "NotFound", {"note": "tweet not found"}, 404)
+        return {"note": "tweet not found"}, 404
+    result = response["data"]["tweetResult"]["result"]
+    match result["__typename"]:
+        case "Tweet":
+            pass
+        case "TweetWithVisibilityResults":
+            result = result["tweet"]
+        case "TweetUnavailable":
+            current_app.log(f"error reading protected tweet: {tweet_id}", level="warning")
+            if error is None: #an account that failed for other reasons might still have been able to see it
+                _remember_failure("tweet", tweet_id, "TweetUnavailable", {"note": result.get("reason", "TweetUnavailable")}, 404)
+            return {"note": result.get("reason", "TweetUnavailable")}, 404
+        case _:
+            current_app.log("Unexpected json structure in response!", level="error", payload=response)
+            return {"note": "unexpected response structure"}, 502
+    data = _dumps(result)
+    _disk_put([(tweet_id, data)])
+    return data, None
+
+def twitter_tweet():
+    tweet_id = request.args["tweet"]
+    tweet = _cached_tweet(tweet_id)
+    if tweet is None: tweet = _recached_tweet(tweet_id)
+    if tweet is not None: return _json_response(tweet)
+    if "debug" in request.args:
+        accounts = _available_accounts("TweetResultByRestId")
+        if not accounts: return {"note": "all accounts are rate limited"}, 429
+        response, error = _request(*graphql.tweet(tweet_id), accounts[0])
+        return response if error is None else ({"note": str(error)}, error)
+    tweet, error = _lookup_tweet(tweet_id)
+    if error is None: return _json_response(tweet)
+    return tweet, error
+
+def _isolated(fn, fallback):
+    #in a stream one bad id must not raise out of the generator and cut off every line after it
+    def run(item):
+        try:
+            return fn(item)
+        except Exception as e:
+            current_app.log(f"{fn.__name__} failed for {item}: {e!r}", level="error")
+            return fallback
+    return run
+
+def _stream_tweets(tweet_ids):
+    pages = {}
+    missing = []
+    for tweet_id in tweet_ids:
+        tweet = _cached_tweet(tweet_id)
+        if tweet is not None:
+            yield tweet + b"\n"
+            continue
+        page = _recache_get(tweet_id)
+        if page is None:
+            missing.append(tweet_id)
+        else:
+            pages.setdefault(page, []).append(tweet_id)
+
+    #each recorded page is fetched once for all of its tweets
+    for page, _ in _imap(_isolated(_recache_page, None), list(pages), bulk_concurrency):
+        for tweet_id in pages[page]:
+            tweet = _cached_tweet(tweet_id, False)
+            if tweet is not None:
+                yield tweet + b"\n"
+            else:
+                missing.append(tweet_id)
+
+    for tweet_id, (tweet, error) in _imap(_isolated(_lookup_tweet, ({"note": "lookup failed"}, 500)), missing, bulk_concurrency):
+        yield (tweet if error is None else _dumps({"tweet_id": tweet_id} | tweet)) + b"\n"
+
+def twitter_tweets():
+    tweet_ids = list(dict.fromkeys(tweet_id for tweet_id in request.args["ids"].split(",") if tweet_id))
+    return Response(stream_with_context(_stream_tweets(tweet_ids)), mimetype="application/x-ndjson")
\ No newline at end of file
@@ -0,0 +1,28 @@
+from .constants import *
+import urllib.parse
+import json
+
+def _static(**fragments):
+    return "".join(f"&{key}={urllib.parse.quote_plus(json.dumps(value))}" for key, value in fragments.items())
+
+#the features/fieldToggles never change, so they are encoded once at import
+_user_by_screen_name = (f"{user_by_screen_name_query_id}/UserByScreenName", _static(features=user_by_screen_name_features, fieldToggles=user_by_screen_name_fieldToggles))
+_user_by_rest_id = (f"{user_by_rest_id_query_id}/UserByRestId", _static(features=user_by_rest_id_features))
+_user_media = (f"{user_media_query_id}/UserMedia", _static(features=user_media_features))
+_tweet = (f"{tweet_query_id}/TweetResultByRestId", _static(features=tweet_features))
+
+def _query(operation, variables):
+    path, static = operation
+    return path, "variables=" + urllib.parse.quote_plus(json.dumps(variables)) + static
+
+def user_by_screen_name(screen_name):
+    return _query(_user_by_screen_name, user_by_screen_name_variables | {"screen_name": screen_name})
+
+def user_by_rest_id(rest_id):
+    return _query(_user_by_rest_id, user_by_rest_id_variables | {"userId": rest_id})
+
+def user_media(rest_id, cursor=None):
+    return _query(_user_media, user_media_variables | {"userId": rest_id} | ({"cursor": cursor} if cursor else {}))
+
+def tweet(tweet_id):
+    return _query(_tweet, tweet_variables | {"tweetId": tweet_id})
\ No newline at end of file
@@ -0,0 +1,139 @@
+from flask import Response, current_app
+from .constants import shared_state_path, metrics_publish_interval, metrics_worker_ttl
+from .queries import insert_metrics, select_metrics
+import threading
+import json
+import time
+
+#a minimal prometheus text exposition registry, so /metrics needs no extra dependency
+_lock = threading.Lock()
+_metrics = []
+_worker = []
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in _worker + list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name, self.documentation, self.labels = name, documentation, labels
+        self.values = {}
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+
+    def samples(self):
+        lines = []
+        with _lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)):
+        self.name, self.documentation, self.labels, self.buckets = name, documentation, labels, buckets
+        self.values = {}
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with _lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+
+    def samples(self):
+        lines = []
+        with _lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(self.labels, key, [('le', bound)])} {bucket}")
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, key)} {count}")
+        return lines
+
+class Gauge:
+    def __init__(self, name, documentation, labels, collect):
+        self.name, self.documentation, self.labels, self.collect = name, documentation, labels, collect
+        _metrics.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+
+    def samples(self):
+        lines = []
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_labels(self.labels, key)} {value}")
+        return lines
+
+def _cache_sizes():
+    state = current_app.state["twitter"]
+    with state["lock"]:
+        return {
+            ("cache", "entries"): len(state["cache"]),
+            ("cache", "bytes"): state["cache"].currsize,
+            ("recache", "entries"): len(state["recache"]),
+            ("pages", "entries"): len(state["pages"])
+        }
+
+upstream_requests = Counter("twitter_upstream_requests_total", "GraphQL calls made upstream.", ("operation", "account", "status"))
+upstream_latency = Histogram("twitter_upstream_latency_seconds", "Latency of upstream GraphQL calls.", ("operation", "account"))
+rate_limited = Counter("twitter_rate_limited_total", "Upstream 429 responses.", ("account",))
+cache_requests = Counter("twitter_cache_requests_total", "Tweet cache lookups.", ("cache", "result"))
+cache_evictions = Counter("twitter_cache_evictions_total", "Entries dropped from in-memory caches.", ("cache", "reason"))
+cache_size = Gauge("twitter_cache_size", "Current size of in-memory caches.", ("cache", "unit"), _cache_sizes)
+sqlite_query = Histogram("twitter_sqlite_query_seconds", "Time spent in SQLite queries.", ("query",), (.0001, .0005, .001, .005, .01, .05, .1, .5, 1))
+hedged_requests = Counter("twitter_hedged_requests_total", "Hedged tweet lookups, by which attempt answered first.", ("winner",))
+log_dropped = Counter("log_records_dropped_total", "Log records dropped because the log queue was full.")
+fallback_depth = Histogram("twitter_account_fallback_depth", "Accounts tried before a media page was served.", (), (1, 2, 3, 4, 5, 10, 20))
+
+def set_worker(worker):
+    #every series from a gunicorn worker carries its slot, so workers never overwrite each other's counters
+    _worker[:] = [("worker", worker)]
+
+def _publish():
+    samples = json.dumps({metric.name: metric.samples() for metric in _metrics})
+    with current_app.connect(shared_state_path) as con:
+        con.execute(insert_metrics, (_worker[0][1], samples, time.time())).close()
+
+def publisher(app):
+    #with several workers a scrape lands on any one of them, so each keeps its latest samples in the shared db
+    with app.app_context():
+        while True:
+            try:
+                _publish()
+            except Exception as e:
+                current_app.log(f"publishing metrics failed: {e!r}", level="error")
+            time.sleep(metrics_publish_interval)
+
+def render():
+    if current_app.state["twitter"]["shared"] and _worker:
+        _publish()
+        cur = current_app.connect(shared_state_path).execute(select_metrics, (time.time() - metrics_worker_ttl,))
+        workers = [json.loads(row["samples"]) for row in cur.fetchall()]
+        cur.close()
+    else:
+        workers = [{metric.name: metric.samples() for metric in _metrics}]
+    lines = []
+    for metric in _metrics:
+        lines += metric.header()
+        for samples in workers:
+            lines += samples.get(metric.name, [])
+    return "\n".join(lines) + "\n"
+
+def view():
+    return Response(render(), mimetype="text/plain; version=0.0.4")
\ No newline at end of file
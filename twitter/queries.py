@@ -17,6 +17,17 @@ create_tables = """
         rest_id      INTEGER NOT NULL
     );
 
+    CREATE TABLE IF NOT EXISTS twitter_sync (
+        rest_id   INTEGER PRIMARY KEY ON CONFLICT REPLACE,
+        newest_id INTEGER NOT NULL,
+        synced_at REAL    NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS twitter_sync_pending (
+        rest_id   INTEGER PRIMARY KEY ON CONFLICT REPLACE,
+        newest_id INTEGER NOT NULL
+    );
+
     CREATE TABLE IF NOT EXISTS twitter_follows (
         follower INTEGER REFERENCES twitter_credentials (account_id) ON UPDATE CASCADE
                          NOT NULL,
@@ -42,6 +53,64 @@ create_tables = """
     CREATE TABLE IF NOT EXISTS twitter_privates (
         rest_id INTEGER PRIMARY KEY ON CONFLICT IGNORE
     );
+
+    CREATE TABLE IF NOT EXISTS twitter_failures (
+        scope   TEXT    NOT NULL,
+        key     TEXT    NOT NULL,
+        kind    TEXT    NOT NULL,
+        body    TEXT    NOT NULL,
+        status  INTEGER NOT NULL,
+        expires REAL    NOT NULL,
+        PRIMARY KEY (
+            scope,
+            key
+        )
+        ON CONFLICT REPLACE
+    );
+"""
+
+create_cache_tables = """
+    CREATE TABLE IF NOT EXISTS twitter_tweet_cache (
+        tweet_id   INTEGER PRIMARY KEY ON CONFLICT REPLACE,
+        tweet      BLOB    NOT NULL,
+        size       INTEGER NOT NULL,
+        fetched_at REAL    NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS twitter_tweet_cache_fetched_at ON twitter_tweet_cache (
+        fetched_at
+    );
+"""
+
+create_shared_tables = """
+    CREATE TABLE IF NOT EXISTS twitter_rate_limits (
+        account_id INTEGER NOT NULL,
+        operation  TEXT    NOT NULL,
+        remaining  INTEGER,
+        reset      REAL    NOT NULL,
+        used       REAL    NOT NULL,
+        PRIMARY KEY (
+            account_id,
+            operation
+        )
+    );
+
+    CREATE TABLE IF NOT EXISTS twitter_recache (
+        tweet_id INTEGER PRIMARY KEY ON CONFLICT REPLACE,
+        rest_id  INTEGER NOT NULL,
+        cursor   TEXT,
+        seen_at  REAL    NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS twitter_recache_seen_at ON twitter_recache (
+        seen_at
+    );
+
+    CREATE TABLE IF NOT EXISTS twitter_metrics (
+        worker  INTEGER PRIMARY KEY ON CONFLICT REPLACE,
+        samples TEXT    NOT NULL,
+        updated REAL    NOT NULL
+    );
 """
 
 select_account_count = """
@@ -60,6 +129,81 @@ select_rest_id = """
         display_name = ?
 """
 
+select_all_rest_ids = """
+    SELECT
+        display_name,
+        rest_id
+    FROM
+        twitter_rest_ids
+"""
+
+select_all_syncs = """
+    SELECT
+        rest_id,
+        newest_id
+    FROM
+        twitter_sync
+"""
+
+select_all_blocks = """
+    SELECT
+        blocked,
+        blocker
+    FROM
+        twitter_blocks
+"""
+
+select_all_privates = """
+    SELECT
+        rest_id
+    FROM
+        twitter_privates
+"""
+
+select_all_follows = """
+    SELECT
+        follower,
+        followed
+    FROM
+        twitter_follows
+"""
+
+select_sync = """
+    SELECT
+        newest_id,
+        (SELECT newest_id FROM twitter_sync_pending WHERE rest_id = ?) as pending
+    FROM
+        (SELECT NULL)
+        LEFT JOIN twitter_sync ON rest_id = ?
+"""
+
+select_blocks_for = """
+    SELECT
+        blocked
+    FROM
+        twitter_blocks
+    WHERE
+        blocker = ?
+"""
+
+select_private = """
+    SELECT
+        rest_id
+    FROM
+        twitter_privates
+    WHERE
+        rest_id = ?
+"""
+
+select_follows_for = """
+    SELECT
+        follower
+    FROM
+        twitter_follows
+    WHERE
+        followed = ?
+"""
+
 select_all_accounts = """
     SELECT
         account_id,
@@ -167,6 +311,23 @@ insert_rest_id = """
         twitter_rest_ids VALUES(?, ?)
 """
 
+insert_sync = """
+    INSERT INTO
+        twitter_sync VALUES(?, ?, ?)
+"""
+
+insert_sync_pending = """
+    INSERT INTO
+        twitter_sync_pending VALUES(?, ?)
+"""
+
+delete_sync_pending = """
+    DELETE FROM
+        twitter_sync_pending
+    WHERE
+        rest_id = ?
+"""
+
 insert_follows = """
     INSERT INTO
         twitter_follows VALUES(?, ?)
@@ -205,4 +366,164 @@ delete_privates = """
         twitter_privates
     WHERE
         rest_id = ?
+"""
+
+select_cached_tweet = """
+    SELECT
+        tweet
+    FROM
+        twitter_tweet_cache
+    WHERE
+        tweet_id = ?
+        and
+        fetched_at > ?
+"""
+
+insert_cached_tweet = """
+    INSERT INTO
+        twitter_tweet_cache VALUES(?, ?, ?, ?)
+"""
+
+delete_expired_cached_tweets = """
+    DELETE FROM
+        twitter_tweet_cache
+    WHERE
+        fetched_at <= ?
+"""
+
+delete_oversized_cached_tweets = """
+    DELETE FROM
+        twitter_tweet_cache
+    WHERE
+        tweet_id IN (
+            SELECT
+                tweet_id
+            FROM (
+                SELECT
+                    tweet_id,
+                    sum(size) OVER (ORDER BY fetched_at DESC, tweet_id DESC) as total
+                FROM
+                    twitter_tweet_cache
+            )
+            WHERE
+                total > ?
+        )
+"""
+
+select_rate_limits = """
+    SELECT
+        account_id,
+        remaining,
+        reset,
+        used
+    FROM
+        twitter_rate_limits
+    WHERE
+        operation = ?
+"""
+
+upsert_rate_limit_use = """
+    INSERT INTO
+        twitter_rate_limits VALUES(?, ?, NULL, 0, ?)
+    ON CONFLICT (account_id, operation) DO UPDATE SET
+        used = excluded.used,
+        remaining = CASE
+            WHEN reset <= excluded.used THEN NULL
+            WHEN remaining > 0 THEN remaining - 1
+            ELSE remaining
+        END
+"""
+
+upsert_rate_limit = """
+    INSERT INTO
+        twitter_rate_limits VALUES(?, ?, ?, ?, ?)
+    ON CONFLICT (account_id, operation) DO UPDATE SET
+        remaining = excluded.remaining,
+        reset = excluded.reset
+"""
+
+select_recache = """
+    SELECT
+        rest_id,
+        cursor
+    FROM
+        twitter_recache
+    WHERE
+        tweet_id = ?
+"""
+
+insert_recache = """
+    INSERT INTO
+        twitter_recache VALUES(?, ?, ?, ?)
+"""
+
+delete_overflowing_recache = """
+    DELETE FROM
+        twitter_recache
+    WHERE
+        tweet_id NOT IN (
+            SELECT
+                tweet_id
+            FROM
+                twitter_recache
+            ORDER BY
+                seen_at DESC
+            LIMIT ?
+        )
+"""
+
+select_all_failures = """
+    SELECT
+        scope,
+        key,
+        body,
+        status,
+        expires
+    FROM
+        twitter_failures
+    WHERE
+        expires > ?
+"""
+
+select_failure = """
+    SELECT
+        body,
+        status,
+        expires
+    FROM
+        twitter_failures
+    WHERE
+        scope = ?
+        and
+        key = ?
+        and
+        expires > ?
+"""
+
+insert_failure = """
+    INSERT INTO
+        twitter_failures VALUES(?, ?, ?, ?, ?, ?)
+"""
+
+delete_expired_failures = """
+    DELETE FROM
+        twitter_failures
+    WHERE
+        expires <= ?
+"""
+
+insert_metrics = """
+    INSERT INTO
+        twitter_metrics VALUES(?, ?, ?)
+"""
+
+select_metrics = """
+    SELECT
+        samples
+    FROM
+        twitter_metrics
+    WHERE
+        updated > ?
+    ORDER BY
+        worker
 """
\ No newline at end of file
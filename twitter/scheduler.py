@@ -0,0 +1,63 @@
+from flask import current_app
+from .constants import *
+from .queries import select_rate_limits, upsert_rate_limit_use, upsert_rate_limit
+import time
+
+def _limit(state, account_id, operation):
+    return state["limits"].setdefault((account_id, operation), {"remaining": None, "reset": 0, "used": 0})
+
+def _load(state, operation):
+    #with several workers the table in shared_state_path is the source of truth, so pull it in before deciding
+    if not state["shared"]: return
+    cur = current_app.connect(shared_state_path).execute(select_rate_limits, (operation,))
+    rows = cur.fetchall()
+    cur.close()
+    with state["lock"]:
+        for row in rows:
+            state["limits"][(row["account_id"], operation)] = {"remaining": row["remaining"], "reset": row["reset"], "used": row["used"]}
+
+def _store(state, query, params):
+    if not state["shared"]: return
+    with current_app.connect(shared_state_path) as con:
+        con.execute(query, params).close()
+
+def available(state, account_id, operation, reserve=rate_limit_reserve):
+    limit = state["limits"].get((account_id, operation))
+    return limit is None or limit["remaining"] is None or limit["remaining"] > reserve or limit["reset"] <= time.time()
+
+def schedule(state, accounts, operation, reserve=rate_limit_reserve):
+    _load(state, operation)
+    with state["lock"]:
+        eligible = [account for account in accounts if available(state, account["account_id"], operation, reserve)]
+        if account_schedule == "lru": #stable sort, so priority breaks ties
+            eligible.sort(key=lambda account: state["limits"].get((account["account_id"], operation), {}).get("used", 0))
+    return eligible
+
+def reserve(state, account_id, operation):
+    now = time.time()
+    with state["lock"]:
+        limit = _limit(state, account_id, operation)
+        limit["used"] = now
+        if limit["reset"] <= now:
+            limit["remaining"] = None
+        elif limit["remaining"]:
+            limit["remaining"] -= 1
+    _store(state, upsert_rate_limit_use, (account_id, operation, now))
+
+def record(state, account_id, operation, status, headers):
+    now = time.time()
+    with state["lock"]:
+        limit = _limit(state, account_id, operation)
+        if "x-rate-limit-remaining" in headers:
+            limit["remaining"] = int(headers["x-rate-limit-remaining"])
+            limit["reset"] = int(headers.get("x-rate-limit-reset", now + rate_limit_fallback))
+        if status == 429:
+            limit["remaining"] = 0
+            if limit["reset"] <= now: limit["reset"] = now + rate_limit_fallback
+        params = (account_id, operation, limit["remaining"], limit["reset"], limit["used"])
+    _store(state, upsert_rate_limit, params)
+
+def exhausted(state, account_id, operation):
+    _load(state, operation)
+    with state["lock"]:
+        return not available(state, account_id, operation)
\ No newline at end of file